@@ -273,11 +273,18 @@ class Route:
         # if debug is True or debug == self.__class__.__name__:
         #     self._debug(frames)
 
+    @staticmethod
+    def _get_location_names(map_location_names: MapLocations, coordinates: List[Coordinates]) -> List[str]:
+        # consecutive locations are often identical (e.g. while looting), so only resolve each distinct coordinate once
+        names = {c: map_location_names[c] for c in set(coordinates)}
+        return [names[c] for c in coordinates]
+
     def _process_locations_visited(self, map_location_names: MapLocations):
         self.locations_visited = [self.landed_name]
         last_location = self.locations[self.landed_location_index][0], self.landed_name
-        for ts, location in self.locations[self.landed_location_index + 1:]:
-            location_name = map_location_names[location]
+        locations = self.locations[self.landed_location_index + 1:]
+        location_names = self._get_location_names(map_location_names, [l.coordinates for l in locations])
+        for (ts, _), location_name in zip(locations, location_names):
             if location_name == 'Unknown':
                 continue
             if location_name == last_location[1] and ts - last_location[0] > 30:
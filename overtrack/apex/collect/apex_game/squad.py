@@ -728,10 +728,11 @@ class Squad:
             return squad_kills
 
 
+_NORM_NAME_TRANS = str.maketrans({c1: c2 for c1, c2 in ('0O', 'DO', 'lI', '1I')})
+
+
 def norm_name(s: str) -> str:
-    rs = s
-    for c1, c2 in '0O', 'DO', 'lI', '1I':
-        rs = rs.replace(c1, c2)
+    rs = s.translate(_NORM_NAME_TRANS)
     for dc in '_-':
         while dc * 2 in rs:
             rs = rs.replace(dc * 2, dc)
@@ -1,7 +1,7 @@
 import json
 import logging
 from collections import deque
-from typing import Callable, List, Optional
+from typing import Callable, Deque, List, Optional, Tuple
 
 from overtrack.apex.collect.apex_game import ApexGame
 from overtrack_cv.frame import Frame
@@ -13,6 +13,9 @@ logger = logging.getLogger(__name__)
 
 class ApexGameExtractor:
     MIN_DURATION = 60
+    # bounds memory if a game end is never seen - well above the frame count of a full length game
+    # past this the oldest frames (including YOUR SQUAD and the landing) are dropped, and a warning is logged
+    MAX_FRAMES = 20_000
 
     def __init__(
             self,
@@ -29,17 +32,23 @@ class ApexGameExtractor:
         self.have_current_game = False
         self.current_key: Optional[str] = None
         self.menuframes = deque(maxlen=25)
-        self.frames: List[Frame] = []
+        self.frames: Deque[Frame] = deque(maxlen=self.MAX_FRAMES)
+        self.frames_dropped = 0
         self.last_seen_frame: Optional[Frame] = None
         self.game_start: Optional[float] = None
 
+        # the last game returned by get_game_in_progress, and the last frame it was built from
+        self._game_in_progress: Optional[Tuple[Frame, ApexGame]] = None
+
         self.games: Optional[List[ApexGame]] = None
         if keep_games:
             self.games: Optional[List[ApexGame]] = []
 
     def _finish_game(self, shutdown: bool = False) -> None:
         logger.info(f'processing game from {len(self.frames)} frames')
-        game = self.get_game_in_progress()
+        if self.frames_dropped:
+            logger.warning(f'Dropped the first {self.frames_dropped} frames of the game - game may be missing its start')
+        game = self.get_game_in_progress(force=True)
         assert game is not None, 'get_game_in_progress() returned None'
         logger.info(f'Processed game: {game}')
 
@@ -50,14 +59,24 @@ class ApexGameExtractor:
             self.games.append(game)
 
         logger.info(f'Clearing {len(self.frames)} frames, setting have_current_game=False')
-        self.frames = []
+        self.frames.clear()
+        self.frames_dropped = 0
+        self._game_in_progress = None
         self.have_current_game = False
         self.current_key = None
 
     def get_game_in_progress(self, force: bool = False) -> Optional[ApexGame]:
+        """
+        :param force: Always rebuild the game, instead of reusing the previous result if no frames have been added since
+        """
         if self.have_current_game and len(self.frames) > 2:
-            frames = list(self.menuframes) + self.frames
-            return ApexGame(frames, key=self.current_key, debug=self.debug)
+            if not force and self._game_in_progress and self._game_in_progress[0] is self.frames[-1]:
+                return self._game_in_progress[1]
+            frames = list(self.menuframes)
+            frames.extend(self.frames)
+            game = ApexGame(frames, key=self.current_key, debug=self.debug)
+            self._game_in_progress = self.frames[-1], game
+            return game
         else:
             return None
 
@@ -67,7 +86,8 @@ class ApexGameExtractor:
 
     def on_frame(self, frame: Frame) -> None:
         self.last_seen_frame = frame
-        time_since_game_start = frame.timestamp - self.frames[0].timestamp if self.have_current_game else -1
+        # use game_start rather than the first frame, which is no longer the start of the game if frames have been dropped
+        time_since_game_start = frame.timestamp - self.game_start if self.have_current_game and self.game_start else -1
 
         if 'your_squad' in frame and not self.have_current_game:
             self.game_start = frame.timestamp
@@ -97,6 +117,13 @@ class ApexGameExtractor:
                 self.game_start = None
 
         if self.have_current_game:
+            if len(self.frames) == self.MAX_FRAMES:
+                if not self.frames_dropped:
+                    logger.warning(
+                        f'Game @{frame.relative_timestamp_str} has reached {self.MAX_FRAMES} frames without ending - '
+                        f'dropping the oldest frames'
+                    )
+                self.frames_dropped += 1
             self.frames.append(frame)
 
     def finish(self) -> None:
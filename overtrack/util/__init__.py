@@ -5,7 +5,7 @@ import dataclasses
 import logging
 import time
 from functools import wraps
-from typing import Callable, Tuple, TypeVar, TYPE_CHECKING
+from typing import Any, Callable, List, Optional, Tuple, TypeVar, TYPE_CHECKING
 
 import typing
 
@@ -17,45 +17,42 @@ if TYPE_CHECKING:
 logger = logging.getLogger(__name__)
 
 BIG_NOODLE_DIGITSUBS = 'O0', 'D0', 'I1', 'L1', 'B8', 'A8', 'S5'
+_BIG_NOODLE_DIGITSUBS_TRANS = str.maketrans({c1: c2 for c1, c2 in BIG_NOODLE_DIGITSUBS})
 
 
 def round_floats(_cls=None, *, precision: int = 2):
-    import numpy as np
+    def round_float(v):
+        return round(float(v), precision)
+
+    def round_optional_float(v):
+        return round(float(v), precision) if isinstance(v, float) else v
+
     def wrap(cls):
         orig__post_init__ = getattr(cls, '__post_init__', None)
 
+        # (field name, rounding function) for each field to round
+        # Resolved on the first instantiation, as @dataclass is applied after this decorator
+        rounders: Optional[List[Tuple[str, Callable[[Any], Any]]]] = None
+
+        def get_rounders() -> List[Tuple[str, Callable[[Any], Any]]]:
+            nonlocal rounders
+            resolved = []
+            for field in dataclasses.fields(cls):
+                if field.type is float:
+                    resolved.append((field.name, round_float))
+                elif getattr(field.type, '__origin__', None) == typing.Union and float in field.type.__args__:
+                    resolved.append((field.name, round_optional_float))
+                # List/Tuple fields are deliberately not rounded - on python 3.7+ their __origin__ is list/tuple rather than
+                # typing.List/Tuple, so they never were, and rounding them now would change the serialised data
+            # only publish the list once it is complete, so other threads never use a partially resolved one
+            rounders = resolved
+            return resolved
+
         def __post_init__(self, *initvars):
             if orig__post_init__:
                 orig__post_init__(self, *initvars)
-            for field in dataclasses.fields(cls):
-                is_float = (
-                    field.type is float or
-                    (
-                        getattr(field.type, '__origin__', None) == typing.Union and
-                        float in field.type.__args__ and
-                        isinstance(getattr(self, field.name), float)
-                    )
-                )
-                if is_float:
-                    object.__setattr__(self, field.name, round(float(getattr(self, field.name)), precision))
-                elif getattr(field.type, '__origin__', None) is typing.Tuple:
-                    object.__setattr__(
-                        self,
-                        field.name,
-                        tuple(
-                            round(float(e), precision) if isinstance(e, (float, np.float, np.float16, np.float32, np.float64)) else e
-                            for e in getattr(self, field.name)
-                        )
-                    )
-                elif getattr(field.type, '__origin__', None) is typing.List:
-                    object.__setattr__(
-                        self,
-                        field.name,
-                        [
-                            round(float(e), precision) if isinstance(e, (float, np.float, np.float16, np.float32, np.float64)) else e
-                            for e in getattr(self, field.name)
-                        ]
-                    )
+            for name, rounder in (rounders if rounders is not None else get_rounders()):
+                object.__setattr__(self, name, rounder(getattr(self, name)))
 
         setattr(cls, '__post_init__', __post_init__)
         return cls
@@ -108,9 +105,7 @@ def validate_fields(a):
 #     for field in
 
 def big_noodle_digitsub(s: str) -> str:
-    for c1, c2 in BIG_NOODLE_DIGITSUBS:
-        s = s.replace(c1, c2)
-    return s
+    return s.translate(_BIG_NOODLE_DIGITSUBS_TRANS)
 
 
 def humansize(nbytes: float, suffixes: Tuple[str, ...]=('B', 'KB', 'MB', 'GB', 'TB', 'PB')) -> str:
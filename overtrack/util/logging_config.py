@@ -1,11 +1,14 @@
-import inspect
+import atexit
+import copy
 import logging
 import logging.config
+import logging.handlers
 import os
+import queue
 import sys
-from collections import defaultdict
+from collections import OrderedDict
 from threading import Thread
-from typing import Any, Callable, DefaultDict, Dict, Optional, Sequence, TYPE_CHECKING, Tuple
+from typing import Any, Callable, Dict, List, Optional, Sequence, TYPE_CHECKING, Tuple
 
 import time
 
@@ -21,7 +24,8 @@ if TYPE_CHECKING:
             'filename': str,
             'maxBytes': int,
             'backupCount': int,
-            'delay': bool
+            'delay': bool,
+            '()': Callable[..., logging.Handler],
         },
         total=False
     )
@@ -42,6 +46,31 @@ else:
 LOG_FORMAT = '[%(asctime)16s | %(levelname)8s | %(name)24s | %(filename)s:%(lineno)s %(funcName)s() ] %(message)s'
 
 
+class _LastLoggedLRU:
+    """
+    The last time each intermittent_log call site logged, and how many times it has been suppressed since.
+    Bounded so call sites logging with many different caller_extra_ids can't grow it forever.
+    """
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self.entries: 'OrderedDict[Any, List[float]]' = OrderedDict()
+
+    def get(self, frame_id: Any) -> Optional[List[float]]:
+        entry = self.entries.get(frame_id)
+        if entry is not None:
+            self.entries.move_to_end(frame_id)
+        return entry
+
+    def __setitem__(self, frame_id: Any, entry: List[float]) -> None:
+        self.entries[frame_id] = entry
+        self.entries.move_to_end(frame_id)
+        if len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+
+_LAST_LOGGED = _LastLoggedLRU(4096)
+
+
 def intermittent_log(
         logger: logging.Logger,
         line: str,
@@ -52,33 +81,36 @@ def intermittent_log(
         fn_override: Optional[str] = None,
         line_override: Optional[int] = None,
         func_override: Optional[str] = None,
-        _caller: Optional[str] = None,
-        _last_logged: DefaultDict[Tuple[str, int], float] = defaultdict(float),
-        _times_suppressed: DefaultDict[Tuple[str, int], float] = defaultdict(int)) -> None:
+        _caller: Optional[str] = None) -> None:
+    if not logger.isEnabledFor(level) and (negative_level is None or not logger.isEnabledFor(negative_level)):
+        # nothing this call could log would be emitted, so skip the caller lookup and rate limiting entirely
+        return
     try:
         caller = None
         if _caller:
             frame_id = _caller, caller_extra_id
         else:
             try:
-                caller = inspect.stack()[1]
-                frame_id = caller.filename, caller.lineno, caller_extra_id
+                # sys._getframe is much cheaper than inspect.stack, which reads the source of every frame on the stack
+                caller = sys._getframe(1)
+                frame_id = caller.f_code.co_filename, caller.f_lineno, caller_extra_id
             except:
                 frame_id = '???'
 
+        now = time.monotonic()
+        last_logged = _LAST_LOGGED.get(frame_id)
         output = negative_level
-        if time.time() - _last_logged[frame_id] > frequency:
-            _last_logged[frame_id] = time.time()
-            if _times_suppressed[frame_id]:
-                line += f' [log suppressed {_times_suppressed[frame_id]} times since last]'
-            _times_suppressed[frame_id] = 0
+        if last_logged is None or now - last_logged[0] > frequency:
+            if last_logged and last_logged[1]:
+                line += f' [log suppressed {last_logged[1]} times since last]'
+            _LAST_LOGGED[frame_id] = [now, 0]
             output = level
         else:
-            _times_suppressed[frame_id] += 1
+            last_logged[1] += 1
         if output and logger.isEnabledFor(output):
             if caller:
-                co = caller.frame.f_code
-                fn, lno, func, sinfo = (co.co_filename, caller.frame.f_lineno, co.co_name, None)
+                co = caller.f_code
+                fn, lno, func, sinfo = (co.co_filename, caller.f_lineno, co.co_name, None)
                 record = logger.makeRecord(
                     logger.name,
                     output,
@@ -113,35 +145,258 @@ upload_logs_settings: UploadLogsSettingsType = {
 }
 
 
-def logname(s: str) -> str:
-    return str(os.path.basename(s)).rsplit('.', 1)[0]
-
+_log_queue: 'queue.SimpleQueue[Tuple[str, logging.LogRecord]]' = queue.SimpleQueue()
+_log_listener: Optional['_FileQueueListener'] = None
+_configured_with: Optional[Tuple[Any, ...]] = None
+_null_handler = logging.NullHandler()
 
-def config_logger(
-        name: str,
-        level: int = logging.INFO,
-
-        write_to_file: bool = True,
-
-        use_stackdriver: bool = False,
-        stackdriver_level: int = logging.INFO,
-        stackdriver_name: Optional[str] = None,
-
-        tracemalloc: bool = False,
-
-        upload_func: Optional[Callable[[str, str], None]] = None,
-        upload_frequency: Optional[float] = None,
 
-        custom_loggers_config: Optional[Dict[str, Dict]] = None,
-
-        format: str = LOG_FORMAT,
-        logdir: str = 'logs') -> None:
-
-    logger = logging.getLogger()
+def logname(s: str) -> str:
+    return str(os.path.basename(s)).rsplit('.', 1)[0]
 
-    if name.endswith('.py'):
-        name = name.rsplit('.')[0]
 
+class _FileQueueHandler(logging.handlers.QueueHandler):
+    """
+    Queues records for the QueueListener to write to the log file with handler id `log_file`.
+    When a logger has several of these, the record is only prepared once and the prepared copy is queued for each file
+    """
+    def __init__(self, queue: 'queue.SimpleQueue[Tuple[str, logging.LogRecord]]', log_file: str):
+        super().__init__(queue)
+        self.log_file = log_file
+
+    def emit(self, record: logging.LogRecord) -> None:
+        try:
+            prepared = record.__dict__.get('_prepared_for_file_log')
+            if prepared is None:
+                prepared = self.prepare(record)
+                record._prepared_for_file_log = prepared
+            self.enqueue((self.log_file, prepared))
+        except Exception:
+            self.handleError(record)
+
+
+_file_queue_handler = _FileQueueHandler(_log_queue, 'file')
+_file_debug_queue_handler = _FileQueueHandler(_log_queue, 'file_debug')
+
+
+class _BatchingRotatingFileHandler(logging.handlers.RotatingFileHandler):
+    """
+    RotatingFileHandler that buffers records and writes them out when flushed, so the rotation size check, write and
+    stream flush happen once per batch instead of once per record.
+    Flushes itself once `capacity` records are buffered, or when a record at `flush_level` or above is logged
+    """
+    capacity = 512
+    flush_level = logging.ERROR
+
+    def __init__(self, filename: str, maxBytes: int, backupCount: int):
+        super().__init__(filename, maxBytes=maxBytes, backupCount=backupCount, delay=True)
+        self.buffer: List[logging.LogRecord] = []
+
+    def emit(self, record: logging.LogRecord) -> None:
+        self.buffer.append(record)
+        if len(self.buffer) >= self.capacity or record.levelno >= self.flush_level:
+            self.flush()
+
+    def flush(self) -> None:
+        with self.lock:
+            if not self.buffer:
+                return
+            records, self.buffer = self.buffer, []
+            lines = []
+            for record in records:
+                try:
+                    lines.append(self.format(record) + self.terminator)
+                except Exception:
+                    self.handleError(record)
+            data = ''.join(lines)
+            try:
+                if self.stream is None:
+                    self.stream = self._open()
+                if self.maxBytes > 0 and os.path.isfile(self.baseFilename):
+                    self.stream.seek(0, 2)
+                    position = self.stream.tell()
+                    if position and position + len(data) >= self.maxBytes:
+                        self.doRollover()
+                        if self.stream is None:
+                            # doRollover leaves the new file to be opened on the next write when delay is set
+                            self.stream = self._open()
+                self.stream.write(data)
+                self.stream.flush()
+            except Exception:
+                self.handleError(records[-1])
+
+    def close(self) -> None:
+        # FileHandler.close only flushes if the file has been opened, which it hasn't until the first batch is written
+        self.flush()
+        super().close()
+
+
+def _rotating_file_handler(filename: str, format: str) -> logging.Handler:
+    handler = _BatchingRotatingFileHandler(
+        filename,
+        maxBytes=1024 * 1024 * 100,
+        backupCount=3,
+    )
+    handler.setFormatter(logging.Formatter(format))
+    return handler
+
+
+class _FileQueueListener(logging.handlers.QueueListener):
+    """
+    QueueListener writing each queued record to the buffered log file handler it was queued for.
+    The INFO/DEBUG levels of the files are applied by their _FileQueueHandlers before records are queued.
+    Flushes them whenever the queue has drained, and at least every `flush_interval` seconds while it is busy,
+    so the files keep up with what has been logged
+    """
+    flush_interval = 5
+
+    def __init__(self, queue: 'queue.SimpleQueue[Tuple[str, logging.LogRecord]]', file_handlers: Dict[str, logging.Handler]):
+        super().__init__(queue, *file_handlers.values())
+        self.file_handlers = file_handlers
+        self.last_flush = time.monotonic()
+
+    def handle(self, item: Tuple[str, logging.LogRecord]) -> None:
+        log_file, record = item
+        self.file_handlers[log_file].handle(record)
+
+    def flush(self) -> None:
+        self.last_flush = time.monotonic()
+        for handler in self.handlers:
+            handler.flush()
+
+    def dequeue(self, block: bool) -> Tuple[str, logging.LogRecord]:
+        self.poll()
+        try:
+            return self.queue.get(False)
+        except queue.Empty:
+            # write out everything buffered before waiting for more records
+            self.flush()
+        while True:
+            try:
+                return self.queue.get(True, self.poll_timeout())
+            except queue.Empty:
+                # QueueListener stops listening if dequeue raises Empty, so poll and keep waiting instead
+                self.poll()
+
+    def poll_timeout(self) -> Optional[float]:
+        """
+        :return: How long to wait for a record before calling `poll`, or None to wait indefinitely
+        """
+        return None
+
+    def poll(self) -> None:
+        if time.monotonic() - self.last_flush > self.flush_interval:
+            self.flush()
+
+
+class _UploadingQueueListener(_FileQueueListener):
+    """
+    _FileQueueListener that also uploads the log files every `upload_frequency` seconds.
+    Uploads are scheduled by the listener thread, so there is no upload thread sleeping between uploads, but each upload
+    runs in a short lived daemon thread so a slow or hung upload can't stall writing the log files or block shutdown
+    """
+    def __init__(
+            self,
+            queue: 'queue.SimpleQueue[Tuple[str, logging.LogRecord]]',
+            file_handlers: Dict[str, logging.Handler],
+            upload_func: Callable[[str, str], None],
+            upload_frequency: float,
+            args: Tuple[str, str]):
+        super().__init__(queue, file_handlers)
+        self.upload_func = upload_func
+        self.upload_frequency = upload_frequency
+        self.args = args
+        self.next_upload = time.monotonic() + upload_frequency
+        self.upload_thread: Optional[Thread] = None
+
+    def poll_timeout(self) -> Optional[float]:
+        return max(self.next_upload - time.monotonic(), 0)
+
+    def poll(self) -> None:
+        super().poll()
+        if time.monotonic() >= self.next_upload:
+            self.upload()
+
+    def upload(self) -> None:
+        self.next_upload = time.monotonic() + self.upload_frequency
+        if self.upload_thread and self.upload_thread.is_alive():
+            logging.getLogger('logging_config').warning(f'Previous log upload is still running - skipping upload')
+            return
+        self.flush()
+        self.upload_thread = Thread(target=self._upload, name='log_upload', daemon=True)
+        self.upload_thread.start()
+
+    def _upload(self) -> None:
+        try:
+            self.upload_func(*self.args)
+        except:
+            logging.getLogger('logging_config').exception(f'Failed to upload log files')
+
+
+def _stop_log_listener() -> None:
+    global _log_listener
+    if _log_listener:
+        _log_listener.stop()
+        _log_listener.flush()
+        _log_listener = None
+
+
+def _flush_file_logs() -> None:
+    # write out everything queued and buffered so far, then keep listening for any records logged afterwards
+    if _log_listener:
+        _log_listener.stop()
+        _log_listener.flush()
+        _log_listener.start()
+
+
+class _DirectFileWriter:
+    """
+    Stands in for the log queue in forked processes, which don't inherit the listener thread.
+    Writes each record to its file handler straight away, as the file handlers did before logging through a queue
+    """
+    def __init__(self, file_handlers: Dict[str, logging.Handler]):
+        self.file_handlers = file_handlers
+
+    def put_nowait(self, item: Tuple[str, logging.LogRecord]) -> None:
+        log_file, record = item
+        handler = self.file_handlers[log_file]
+        handler.handle(record)
+        handler.flush()
+
+
+def _write_file_logs_directly_in_child() -> None:
+    global _log_queue, _log_listener
+    # the parent's queue may hold its records, or have been locked mid-put when forking
+    _log_queue = queue.SimpleQueue()
+    if not _log_listener:
+        _file_queue_handler.queue = _file_debug_queue_handler.queue = _log_queue
+        return
+    file_handlers = _log_listener.file_handlers
+    for handler in file_handlers.values():
+        # records buffered before forking are written by the parent
+        handler.buffer = []
+    _file_queue_handler.queue = _file_debug_queue_handler.queue = _DirectFileWriter(file_handlers)
+    _log_listener = None
+
+
+def _shared_null_handler() -> logging.Handler:
+    return _null_handler
+
+
+def _shared_file_queue_handler() -> logging.Handler:
+    return _file_queue_handler
+
+
+def _shared_file_debug_queue_handler() -> logging.Handler:
+    return _file_debug_queue_handler
+
+
+atexit.register(_stop_log_listener)
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_write_file_logs_directly_in_child)
+
+
+def _build_dictconfig(level: int, write_to_file: bool, format: str, logdir: str) -> Dict[str, Any]:
     handlers: Dict[str, LogConfig] = {
         'default': {
             'level': logging.getLevelName(level),
@@ -150,25 +405,16 @@ def config_logger(
         }
     }
     if write_to_file:
-        os.makedirs(logdir, exist_ok=True)
         handlers.update({
+            # the log files are written by a QueueListener thread so logging calls don't block on file IO.
+            # Each id only queues records for its own file, and a record logged to both is only prepared once
             'file': {
                 'level': 'INFO',
-                'formatter': 'standard',
-                'class': 'logging.handlers.RotatingFileHandler',
-                'filename': f'{logdir}/{name}.log',
-                'maxBytes': 1024 * 1024 * 100,
-                'backupCount': 3,
-                'delay': True
+                '()': _shared_file_queue_handler,
             },
             'file_debug': {
                 'level': 'DEBUG',
-                'formatter': 'standard',
-                'class': 'logging.handlers.RotatingFileHandler',
-                'filename': f'{logdir}/{name}.debug.log',
-                'maxBytes': 1024 * 1024 * 100,
-                'backupCount': 3,
-                'delay': True
+                '()': _shared_file_debug_queue_handler,
             },
             'web_access': {
                 'level': 'DEBUG',
@@ -183,17 +429,17 @@ def config_logger(
     else:
         handlers.update({
             'file': {
-                'class': 'logging.NullHandler',
+                '()': _shared_null_handler,
             },
             'file_debug': {
-                'class': 'logging.NullHandler',
+                '()': _shared_null_handler,
             },
             'web_access': {
-                'class': 'logging.NullHandler',
+                '()': _shared_null_handler,
             }
         })
 
-    logging.config.dictConfig({
+    return {
         'version': 1,
         'disable_existing_loggers': False,
         'formatters': {
@@ -236,10 +482,88 @@ def config_logger(
                 'level': 'ERROR',
                 'propagate': False
             },
+        }
+    }
+
+
+def config_logger(
+        name: str,
+        level: int = logging.INFO,
+
+        write_to_file: bool = True,
+
+        use_stackdriver: bool = False,
+        stackdriver_level: int = logging.INFO,
+        stackdriver_name: Optional[str] = None,
 
-            **(custom_loggers_config or {})
+        tracemalloc: bool = False,
+
+        upload_func: Optional[Callable[[str, str], None]] = None,
+        upload_frequency: Optional[float] = None,
+
+        custom_loggers_config: Optional[Dict[str, Dict]] = None,
+
+        format: str = LOG_FORMAT,
+        logdir: str = 'logs') -> None:
+
+    global _log_listener, _configured_with
+
+    logger = logging.getLogger()
+
+    if name.endswith('.py'):
+        name = name.rsplit('.')[0]
+
+    configured_with = (
+        name, level, write_to_file,
+        use_stackdriver, stackdriver_level, stackdriver_name,
+        tracemalloc,
+        upload_func, upload_frequency,
+        # copied so editing the caller's dict in place and configuring again isn't mistaken for the same config
+        copy.deepcopy(custom_loggers_config),
+        format, logdir
+    )
+    if configured_with == _configured_with:
+        # reinstalling the same config would only recreate the same handlers and duplicate the background threads
+        return
+    # only record the arguments once configuring with them has succeeded, so a failed config can be retried
+    _configured_with = None
+
+    _stop_log_listener()
+
+    file = f'{logdir}/{name}.log'
+    file_debug = f'{logdir}/{name}.debug.log'
+    if write_to_file:
+        os.makedirs(logdir, exist_ok=True)
+
+    dictconfig = _build_dictconfig(level, write_to_file, format, logdir)
+    if custom_loggers_config:
+        dictconfig = {
+            **dictconfig,
+            'loggers': {
+                **dictconfig['loggers'],
+                **custom_loggers_config
+            }
+        }
+    logging.config.dictConfig(dictconfig)
+
+    if write_to_file:
+        # queue for the listener again, in case this process was forked while writing to the files directly
+        _file_queue_handler.queue = _file_debug_queue_handler.queue = _log_queue
+        file_handlers = {
+            'file': _rotating_file_handler(file, format),
+            'file_debug': _rotating_file_handler(file_debug, format),
         }
-    })
+        if upload_func and upload_frequency:
+            _log_listener = _UploadingQueueListener(
+                _log_queue,
+                file_handlers,
+                upload_func=upload_func,
+                upload_frequency=upload_frequency,
+                args=(file, file_debug)
+            )
+        else:
+            _log_listener = _FileQueueListener(_log_queue, file_handlers)
+        _log_listener.start()
 
     if use_stackdriver:
         import google.cloud.logging
@@ -295,32 +619,23 @@ def config_logger(
     #     )
     #     logger.addHandler(datadog_handler)
 
-    for _ in range(3):
-        logger.info('')
-    logger.info(f'Command: "{" ".join(sys.argv)}", pid={os.getpid()}, name={name}')
+    # blank lines to separate runs in the log files, as part of the same record so it's only written once
+    logger.info(f'\n\n\nCommand: "{" ".join(sys.argv)}", pid={os.getpid()}, name={name}')
     if use_stackdriver:
         logger.info(f'Connected to google cloud logging. Using name={name!r}. Logging class: {logging.getLoggerClass()}')
 
     upload_logs_settings['write_to_file'] = write_to_file
     if write_to_file and upload_func and upload_frequency:
         upload_logs_settings['upload_func'] = upload_func
-        file: str = handlers['file']['filename']
-        file_debug: str = handlers['file_debug']['filename']
         # noinspection PyTypeChecker
         upload_logs_settings['args'] = file, file_debug
-
-        def upload_loop() -> None:
-            while True:
-                assert upload_frequency
-                assert upload_func
-                time.sleep(upload_frequency)
-                upload_func(handlers['file']['filename'], handlers['file_debug']['filename'])
         logger.info(f'Uploading log files every {upload_frequency}s')
-        Thread(target=upload_loop, daemon=True).start()
 
     logging.getLogger('tensorflow').setLevel(logging.ERROR)
     os.environ['TF_CPP_MIN_LOG_LEVEL'] = '2'
 
+    _configured_with = configured_with
+
     # hsh = hashlib.md5()
     # modules = [
     #     m.__file__ for m in globals().values() if
@@ -335,6 +650,7 @@ def config_logger(
 
 
 def finish_logging() -> None:
+    _flush_file_logs()
     if upload_logs_settings.get('write_to_file') and upload_logs_settings.get('upload_func') and upload_logs_settings.get('args'):
         upload_logs_settings['upload_func'](*upload_logs_settings['args'])
 
@@ -375,11 +691,43 @@ def patch_sentry_locals_capture() -> None:
             return list(value)
         return NotImplemented
 
-    add_global_repr_processor(frame_processor)
-    add_global_repr_processor(frame_list_processor)
-    add_global_repr_processor(large_list_processor)
-    add_global_repr_processor(large_str_processor)
-    add_global_repr_processor(set_processor)
+    def list_processor(value, hint):
+        result = frame_list_processor(value, hint)
+        if result is NotImplemented:
+            result = large_list_processor(value, hint)
+        return result
+
+    def no_processor(value, hint):
+        return NotImplemented
+
+    # sentry runs the repr processors on every value it serializes - dispatch on the exact type first so common values
+    # skip the isinstance checks (especially against the Sequence ABC), and only fall back to them for other types
+    processors_by_type = {
+        Frame: frame_processor,
+        list: list_processor,
+        tuple: large_list_processor,
+        str: large_str_processor,
+        bytes: large_str_processor,
+        set: set_processor,
+        dict: no_processor,
+        int: no_processor,
+        float: no_processor,
+        bool: no_processor,
+        type(None): no_processor,
+    }
+    fallback_processors = frame_processor, frame_list_processor, large_list_processor, large_str_processor, set_processor
+
+    def repr_processor(value, hint):
+        processor = processors_by_type.get(type(value))
+        if processor:
+            return processor(value, hint)
+        for processor in fallback_processors:
+            result = processor(value, hint)
+            if result is not NotImplemented:
+                return result
+        return NotImplemented
+
+    add_global_repr_processor(repr_processor)
 
 
 CLOUD_INIT_OUTPUT = '/var/log/cloud-init-output.log'
@@ -123,37 +123,97 @@ class ExtractionRegionsCollection:
         if not lazy:
             self._ensure_loaded()
 
+    @property
+    def compiled_path(self) -> str:
+        return self.path[:-3] + 'json'
+
     def eager_load(self):
         self._ensure_loaded()
 
+    def compile(self) -> str:
+        """
+        Write the regions to a json file alongside the zip so they can be loaded without decoding the layer PNGs
+
+        :return: The path of the compiled regions
+        """
+        self._ensure_loaded()
+        with open(self.compiled_path, 'w') as f:
+            json.dump(
+                {
+                    'zip_layers': self._zip_layers(),
+                    'regions': {
+                        region.name + ('' if region.include_when_blanking else '*'): region.regions
+                        for region in self.regions.values()
+                    },
+                },
+                f,
+                indent=2
+            )
+            f.write('\n')
+        return self.compiled_path
+
+    @staticmethod
+    def _region_layers(z: zipfile.ZipFile) -> List[Tuple[zipfile.ZipInfo, str, bool]]:
+        """
+        :return: The zip entry, region name and include_when_blanking of each region layer in the zip
+        """
+        layers = []
+        for info in z.infolist():
+            f = info.filename
+            if not f.startswith('L') or not f.endswith('.png'):
+                # not a layer
+                continue
+            layer_props = f.rsplit('.', 1)[0].split(',')
+            layer_name = layer_props[3].replace('%002E', '.')
+            include_when_blanking = '%002A' not in layer_name  # %002A is '*'
+            layer_name = layer_name.replace('%002A', '')
+            if not layer_name.startswith('region.'):
+                continue
+            layers.append((info, layer_name[len('region.'):], include_when_blanking))
+        return layers
+
+    def _zip_layers(self) -> Dict[str, List[int]]:
+        # the CRC32 and size of each region layer are read from the zip's central directory, so checking them doesn't
+        # read any layer data
+        with zipfile.ZipFile(self.path) as z:
+            return {
+                info.filename: [info.CRC, info.file_size]
+                for info, _, _ in self._region_layers(z)
+            }
+
+    def _load_compiled(self) -> Optional[Dict[str, List[List[int]]]]:
+        """
+        :return: The compiled regions, or None if there are none or they were not compiled from the current zip
+        """
+        if not os.path.exists(self.compiled_path):
+            return None
+        with open(self.compiled_path) as f:
+            compiled = json.load(f)
+        if 'zip_layers' not in compiled:
+            # regions compiled without recording the zip they came from are only used when there is no zip
+            return None if os.path.exists(self.path) else compiled
+        if os.path.exists(self.path) and compiled['zip_layers'] != self._zip_layers():
+            logger.warning(f'Ignoring compiled regions {self.compiled_path} - {self.path} has changed since they were compiled')
+            return None
+        return compiled['regions']
+
     def _ensure_loaded(self) -> None:
         if self.regions is not None:
             return
         regions: Dict[str, ExtractionRegions] = {}
 
-        altpath = self.path[:-3] + 'json'
-        if not os.path.exists(self.path) and os.path.exists(altpath):
-            logger.info(f'Using compiled regions: {altpath}')
-            with open(altpath) as f:
-                regions = {
-                    k: ExtractionRegions(k, None, [tuple(e) for e in v])
-                    for k, v in json.load(f).items()
-                }
+        compiled = self._load_compiled()
+        if compiled is not None:
+            logger.info(f'Using compiled regions: {self.compiled_path}')
+            regions = {
+                k.rstrip('*'): ExtractionRegions(k.rstrip('*'), None, [tuple(e) for e in v], include_when_blanking=not k.endswith('*'))
+                for k, v in compiled.items()
+            }
 
         else:
             with zipfile.ZipFile(self.path) as z:
-                for f in z.namelist():
-                    if not f.startswith('L') or not f.endswith('.png'):
-                        # not a layer
-                        continue
-                    layer_props = f.rsplit('.', 1)[0].split(',')
-                    layer_name = layer_props[3].replace('%002E', '.')
-                    include_when_blanking = '%002A' not in layer_name  # %002A is '*'
-                    layer_name = layer_name.replace('%002A', '')
-                    if not layer_name.startswith('region.'):
-                        continue
-                    region_name = layer_name[len('region.'):]
-                    with z.open(f, 'r') as fobj:
+                for info, region_name, include_when_blanking in self._region_layers(z):
+                    with z.open(info, 'r') as fobj:
                         logger.debug('Loading region %s from %s', region_name, self.path)
                         layer = cv2.imdecode(np.frombuffer(fobj.read(), dtype=np.uint8), -1)
                         regions[region_name] = ExtractionRegions(region_name, layer, include_when_blanking=include_when_blanking)
@@ -192,4 +252,7 @@ class ExtractionRegionsCollection:
         return np.bitwise_and(image, mask)
 
 if __name__ == '__main__':
-    print(ExtractionRegionsCollection('../game/tab/data/regions/16_9.zip'))
+    import sys
+    for path in sys.argv[1:]:
+        collection = ExtractionRegionsCollection(path)
+        print(f'Compiled {collection} to {collection.compile()}')
@@ -141,7 +141,8 @@ def best_match(
         level: Optional[int] = logging.INFO,
         disable_log: bool = False,
         **kwargs: Any) -> Optional[Union[T, str]]:
-    options = list(options)
+    if not isinstance(options, (list, tuple)):
+        options = list(options)
     use_ratio = 0 < threshold < 1
 
     if not len(text):
@@ -291,8 +291,9 @@ class Teams:
         if game_mode == game_modes.competitive:
             self.logger.info(f'Resolving ranks from agent select')
             for f in frames:
-                if f.valorant.agent_select and f.valorant.agent_select.agents and f.valorant.agent_select.ranks:
-                    for a, (rank, rank_match) in zip(f.valorant.agent_select.agents, f.valorant.agent_select.ranks):
+                agent_select = f.valorant.agent_select
+                if agent_select is not None and agent_select.agents and agent_select.ranks:
+                    for a, (rank, rank_match) in zip(agent_select.agents, agent_select.ranks):
                         agent = textops.best_match(a, agents.keys(), threshold=0.8, disable_log=True)
                         self.logger.debug(f'{a} => {agent} => {rank} ({rank_match})')
                         if agent and rank_match < 20:
@@ -4,14 +4,17 @@ import itertools
 import os
 
 import datetime
+import functools
 import logging
-from collections import Counter
+import operator
+import typing
+from collections import Counter, deque
 
 import requests
 
 from overtrack.source.twitch_source import TwitchSource
 from overtrack.valorant.collect.valorant_game.performance_stats import PerformanceStats
-from typing import List, ClassVar, Tuple, Union, Optional, Dict, Any, cast
+from typing import List, ClassVar, Tuple, Union, Optional, Dict, Any, Deque, cast
 
 import shortuuid
 from dataclasses import dataclass, fields
@@ -32,6 +35,72 @@ from overtrack_models.dataclasses.typedload import referenced_typedload, typedlo
 VERSION = '1.2.0'
 GET_VOD_URL = os.environ.get('GET_VOD_URL', 'https://m9e3shy2el.execute-api.us-west-2.amazonaws.com/{twitch_user}/vod/{time}?pts={pts}')
 
+_VALORANT_FRAME_DATA_FIELDS = tuple(f.name for f in fields(ValorantFrameData))
+_get_agent_select_postgame = operator.attrgetter('agent_select', 'postgame')
+
+_MAP_CANDIDATES = tuple(f'MAP - {m.upper()}' for m in data.maps) + tuple(data.maps)
+_MAP_RESULTS = tuple(data.maps) * 2
+_MODE_CANDIDATES = (
+    tuple(f'STANDARD - {m.upper()}' for m in data.game_modes[:-1]) +
+    tuple(data.game_modes[:-1]) + (data.game_modes.spike_rush.upper(), 'spike rush - custom'.upper())
+)
+_MODE_RESULTS = tuple(data.game_modes[:-1]) + tuple(data.game_modes) + ('spike rush - custom', )
+
+
+# the same OCR text repeats across many frames, so only fuzzy match each distinct text once
+@functools.lru_cache(maxsize=256)
+def _best_map(map_text: str) -> Optional[MapName]:
+    return textops.best_match(
+        map_text,
+        _MAP_CANDIDATES,
+        _MAP_RESULTS,
+        threshold=0.75,
+        disable_log=True,
+    )
+
+
+@functools.lru_cache(maxsize=256)
+def _best_mode(mode_text: str) -> Optional[GameModeName]:
+    return textops.best_match(
+        mode_text,
+        _MODE_CANDIDATES,
+        _MODE_RESULTS,
+        threshold=0.75,
+        disable_log=True,
+    )
+
+
+@dataclass
+class _FramesView:
+    """
+    The per-frame data ValorantGame resolves from directly, extracted from the frames in a single pass
+    """
+    framemakeup: typing.Counter[str]
+    map_texts: List[str]
+    # the game mode is only resolved from the last 50 texts seen
+    mode_texts: Deque[str]
+
+    @classmethod
+    def from_frames(cls, frames: List[Frame]) -> '_FramesView':
+        framemakeup = Counter()
+        map_texts = []
+        mode_texts = deque(maxlen=50)
+        for frame in frames:
+            v = frame.valorant
+            for name in _VALORANT_FRAME_DATA_FIELDS:
+                if getattr(v, name):
+                    framemakeup[name] += 1
+            ag, pg = _get_agent_select_postgame(v)
+            if ag is not None and ag.map:
+                map_texts.append(ag.map)
+            elif pg is not None and pg.map:
+                map_texts.append(pg.map)
+            if ag is not None and ag.game_mode:
+                mode_texts.append(ag.game_mode)
+            elif pg is not None and pg.game_mode:
+                mode_texts.append(pg.game_mode)
+        return cls(framemakeup, map_texts, mode_texts)
+
 
 class NoMap(InvalidGame):
     pass
@@ -45,6 +114,11 @@ class UnsupportedMode(InvalidMode):
 
 @dataclass
 class ValorantGame:
+    __slots__ = (
+        'key', 'timestamp', 'duration', 'won', 'map', 'game_mode', 'spectated', 'rank', 'rounds', 'teams',
+        'start_pts', 'vod', 'clips', 'season_mode_id', 'frames_count', 'game_version', 'version',
+    )
+
     key: str
     timestamp: float
     duration: float
@@ -101,24 +175,21 @@ class ValorantGame:
         else:
             self.start_pts = None
 
-        framemakeup = Counter()
-        for frame in frames:
-            for f in fields(ValorantFrameData):
-                if getattr(frame.valorant, f.name):
-                    framemakeup[f.name] += 1
-        self.logger.info(f'Frame data seen: {framemakeup}')
+        view = _FramesView.from_frames(frames)
+        self.logger.info('Frame data seen: %s', view.framemakeup)
 
         self.timestamp = frames[0].timestamp
+        start_time = self.time
         if key:
             self.key = key
         else:
             slug = shortuuid.uuid()[:6]
-            self.key = f'VALORANT/{self.time.strftime("%Y-%m-%d-%H-%M")}-{slug}'
+            self.key = f'VALORANT/{start_time.strftime("%Y-%m-%d-%H-%M")}-{slug}'
 
         self.spectated = False
 
-        self.map = self._resolve_map(frames)
-        self.game_mode = self._resolve_game_mode(frames)
+        self.map = self._resolve_map(view.map_texts)
+        self.game_mode = self._resolve_game_mode(view.mode_texts)
 
         self.rounds = Rounds(frames, self.game_mode, debug)
         self.duration = self.rounds[-1].end
@@ -163,60 +234,34 @@ class ValorantGame:
                 self.vod, twitch_username = vod_username
                 self.clips = make_clips(self, frames, twitch_username)
 
-        self.game_version = data.get_version(self.time).name
+        self.game_version = data.get_version(start_time).name
 
         self.version = VERSION
 
-    def _resolve_map(self, frames: List[Frame]) -> Optional[MapName]:
+    def _resolve_map(self, map_texts: List[str]) -> Optional[MapName]:
         mapcounter = Counter()
-        map_texts = []
-        for f in frames:
-            if f.valorant.agent_select and f.valorant.agent_select.map:
-                map_texts.append(f.valorant.agent_select.map)
-            elif f.valorant.postgame and f.valorant.postgame.map:
-                map_texts.append(f.valorant.postgame.map)
-        for map_text in map_texts:
-            map_ = textops.best_match(
-                map_text,
-                [f'MAP - {m.upper()}' for m in data.maps] + data.maps,
-                data.maps + data.maps,
-                threshold=0.75,
-                disable_log=False,
-                )
+        for map_text, count in Counter(map_texts).items():
+            map_ = _best_map(map_text)
             if map_:
-                mapcounter[map_] += 1
+                mapcounter[map_] += count
         if not len(mapcounter):
             raise NoMap()
         bestmap, count = mapcounter.most_common(1)[0]
-        self.logger.info(f'Resolving map {mapcounter} -> {bestmap}')
+        self.logger.info('Resolving map %s -> %s', mapcounter, bestmap)
         if len(mapcounter) > 1 and mapcounter.most_common(2)[1][1] > 0.25 * count:
             self.logger.error('Got multiple matching maps')
         return bestmap
 
-    def _resolve_game_mode(self, frames: List[Frame]) -> Optional[GameModeName]:
+    def _resolve_game_mode(self, mode_texts: Deque[str]) -> Optional[GameModeName]:
         modecounter = Counter()
-        mode_texts = []
-        for f in frames:
-            if f.valorant.agent_select and f.valorant.agent_select.game_mode:
-                mode_texts.append(f.valorant.agent_select.game_mode)
-            elif f.valorant.postgame and f.valorant.postgame.game_mode:
-                mode_texts.append(f.valorant.postgame.game_mode)
-        mode_texts = mode_texts[-50:]
-        for mode_text in mode_texts:
-            mode = textops.best_match(
-                mode_text,
-                [f'STANDARD - {m.upper()}' for m in data.game_modes[:-1]] +
-                data.game_modes[:-1] + [data.game_modes.spike_rush.upper(), 'spike rush - custom'.upper()],
-                data.game_modes[:-1] + data.game_modes + ['spike rush - custom'],
-                threshold=0.75,
-                disable_log=False,
-            )
+        for mode_text, count in Counter(mode_texts).items():
+            mode = _best_mode(mode_text)
             if mode:
-                modecounter[mode] += 1
+                modecounter[mode] += count
         if not len(modecounter):
             raise NoMode()
         bestmode, _ = modecounter.most_common(1)[0]
-        self.logger.info(f'Resolving mode {modecounter} -> {bestmode}')
+        self.logger.info('Resolving mode %s -> %s', modecounter, bestmode)
         if bestmode == 'spike rush - custom':
             raise UnsupportedMode()
         return bestmode
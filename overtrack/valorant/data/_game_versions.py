@@ -1,3 +1,4 @@
+import bisect
 import datetime
 
 from dataclasses import dataclass
@@ -22,9 +23,14 @@ def _parse_nzt(s: str) -> datetime.datetime:
 
 @dataclass
 class GameVersion:
+    __slots__ = ('name', 'published', 'published_ts')
+
     name: str
     published: datetime.datetime
 
+    def __post_init__(self) -> None:
+        self.published_ts: float = self.published.timestamp()
+
 
 game_versions = [
     GameVersion(
@@ -58,10 +64,15 @@ game_versions = [
 ]
 
 
+_published_ts = [v.published_ts for v in game_versions]
+assert _published_ts == sorted(_published_ts), 'game_versions must be in published order'
+
+
 def get_version(t: datetime.datetime) -> GameVersion:
-    for v in reversed(game_versions):
-        if t > v.published:
-            return v
+    # last version published strictly before t
+    i = bisect.bisect_left(_published_ts, t.timestamp()) - 1
+    if i >= 0:
+        return game_versions[i]
     else:
         return game_versions[0]
 
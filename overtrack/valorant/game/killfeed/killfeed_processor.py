@@ -1,4 +1,6 @@
+import hashlib
 import string
+from collections import OrderedDict
 
 from overtrack_cv.core import textops
 from overtrack_cv_private.games.valorant.processors.killfeed.models import *
@@ -31,6 +33,28 @@ def load_agent_template(path) -> Tuple[np.ndarray, np.ndarray]:
     return image[:, :, :3], cv2.cvtColor(image[:, :, 3], cv2.COLOR_GRAY2BGR)
 
 
+_NAME_OCR_CACHE: 'OrderedDict[Tuple[bytes, Tuple[int, ...]], str]' = OrderedDict()
+_NAME_OCR_CACHE_SIZE = 512
+
+
+def ocr_name(image: np.ndarray) -> str:
+    """
+    OCR a killfeed name, reusing the result for crops identical to one already seen
+
+    Kill rows stay in the killfeed for several seconds, so the same name crop is seen over many consecutive frames.
+    """
+    key = hashlib.blake2s(image.tobytes(), digest_size=8).digest(), image.shape
+    text = _NAME_OCR_CACHE.get(key)
+    if text is None:
+        text = imageops.tesser_ocr(image, engine=imageops.tesseract_lstm).upper()
+        _NAME_OCR_CACHE[key] = text
+        if len(_NAME_OCR_CACHE) > _NAME_OCR_CACHE_SIZE:
+            _NAME_OCR_CACHE.popitem(last=False)
+    else:
+        _NAME_OCR_CACHE.move_to_end(key)
+    return text
+
+
 def str2col(s):
     s = sum(ord(c) for c in s) % 255
     return tuple(cv2.cvtColor(np.array((s, 230, 255), dtype=np.uint8).reshape((1, 1, 3)), cv2.COLOR_HSV2BGR_FULL)[0, 0].tolist())
@@ -74,14 +98,9 @@ class KillfeedProcessor(Processor):
     ENEMY_KILL_TEMPLATE = imageops.imread(os.path.join(os.path.dirname(__file__), 'data', 'enemy_kill.png'), 0)
     KILL_THRESHOLD = 0.95
 
-    AGENT_DEATH_TEMPLATES: Dict[AgentName, Tuple[np.ndarray, np.ndarray]] = {
-        name: load_agent_template(os.path.join(os.path.dirname(__file__), 'data', 'agents', name.lower() + '.png'))
-        for name in agents
-    }
-    AGENT_KILLER_TEMPLATES: Dict[AgentName, Tuple[np.ndarray, np.ndarray]] = {
-        n: (a[0][:, ::-1], a[1][:, ::-1])
-        for n, a in AGENT_DEATH_TEMPLATES.items()
-    }
+    # agent and weapon templates are loaded on first use (or by eager_load) - see _load_templates
+    AGENT_DEATH_TEMPLATES: Optional[Dict[AgentName, Tuple[np.ndarray, np.ndarray]]] = None
+    AGENT_KILLER_TEMPLATES: Optional[Dict[AgentName, Tuple[np.ndarray, np.ndarray]]] = None
     AGENT_THRESHOLD = 50
 
     WEAPON_NAMES = [
@@ -130,31 +149,57 @@ class KillfeedProcessor(Processor):
 
         'viper.snake_bite',
     ]
-    WEAPON_IMAGES = {
-        n: imageops.imread(os.path.join(os.path.dirname(__file__), 'data', 'weapons', n + '.png'), 0)
-        for n in WEAPON_NAMES
-    }
-    for n, im in WEAPON_IMAGES.items():
-        assert im.shape[1] <= 145, f'{n} image dimensions too high: {im.shape[1]}'
-    WEAPON_TEMPLATES = {
-        w: cv2.GaussianBlur(
-            cv2.dilate(
-                cv2.copyMakeBorder(image, 5, 35 - image.shape[0], 5, 145 - image.shape[1], cv2.BORDER_CONSTANT),
-                None
-            ),
-            (0, 0),
-            0.5
-        )
-        for w, image in WEAPON_IMAGES.items()
-    }
+    WEAPON_IMAGES: Optional[Dict[str, np.ndarray]] = None
+    WEAPON_TEMPLATES: Optional[Dict[str, np.ndarray]] = None
     WEAPON_THRESHOLD = 0.85
 
     WALLBANG_TEMPLATE = imageops.imread(os.path.join(os.path.dirname(__file__), 'data', 'kill_modifiers', 'wallbang.png'), 0)
     HEADSHOT_TEMPLATE = imageops.imread(os.path.join(os.path.dirname(__file__), 'data', 'kill_modifiers', 'headshot.png'), 0)
     KILL_MODIFIER_THRESHOLD = 0.75
 
+    @classmethod
+    def _load_templates(cls) -> None:
+        if cls.WEAPON_TEMPLATES is not None:
+            return
+        logger.info('Loading agent and weapon templates')
+
+        agent_death_templates = {
+            name: load_agent_template(os.path.join(os.path.dirname(__file__), 'data', 'agents', name.lower() + '.png'))
+            for name in agents
+        }
+        cls.AGENT_DEATH_TEMPLATES = agent_death_templates
+        cls.AGENT_KILLER_TEMPLATES = {
+            n: (a[0][:, ::-1], a[1][:, ::-1])
+            for n, a in agent_death_templates.items()
+        }
+
+        weapon_images = {
+            n: imageops.imread(os.path.join(os.path.dirname(__file__), 'data', 'weapons', n + '.png'), 0)
+            for n in cls.WEAPON_NAMES
+        }
+        for n, im in weapon_images.items():
+            assert im.shape[1] <= 145, f'{n} image dimensions too high: {im.shape[1]}'
+        cls.WEAPON_IMAGES = weapon_images
+        # set last - WEAPON_TEMPLATES being set marks the templates as loaded
+        cls.WEAPON_TEMPLATES = {
+            w: cv2.GaussianBlur(
+                cv2.dilate(
+                    cv2.copyMakeBorder(image, 5, 35 - image.shape[0], 5, 145 - image.shape[1], cv2.BORDER_CONSTANT),
+                    None
+                ),
+                (0, 0),
+                0.5
+            )
+            for w, image in weapon_images.items()
+        }
+
+    def eager_load(self):
+        self.REGIONS.eager_load()
+        self._load_templates()
+
     # @time_processing
     def process(self, frame: Frame) -> bool:
+        self._load_templates()
         x, y, w, h = self.REGIONS['killfeed'].regions[0]
         region = self.REGIONS['killfeed'].extract_one(frame.image)
 
@@ -166,10 +211,7 @@ class KillfeedProcessor(Processor):
 
         friendly_kill_match = cv2.matchTemplate(h, self.FRIENDLY_KILL_TEMPLATE, cv2.TM_CCORR_NORMED)
         enemy_kill_match = cv2.matchTemplate(h, self.ENEMY_KILL_TEMPLATE, cv2.TM_CCORR_NORMED)
-        kill_match = np.max(
-            np.stack((friendly_kill_match, enemy_kill_match), axis=-1),
-            axis=2,
-        )
+        kill_match = np.maximum(friendly_kill_match, enemy_kill_match)
 
         kill_rows = []
 
@@ -359,25 +401,18 @@ class KillfeedProcessor(Processor):
                 debug_image=frame.debug_image,
             )
         # cv2.imwrite(f'C:/tmp/agents2/{region_x}.png', agent_im)
-        agent_matches = {}
-        agent_match_m = []
-        t = None
-        for a, t in [self.AGENT_KILLER_TEMPLATES, self.AGENT_DEATH_TEMPLATES][agent_death].items():
-            match = cv2.matchTemplate(agent_im, t[0], cv2.TM_SQDIFF, mask=t[1])
-            agent_matches[a] = match
-            agent_match_m.append(match)
-            print(a, np.min(match) / 33.6, np.max(match))
-        agent_match_m = np.min(np.stack(agent_match_m, axis=-1), axis=2)
+        templates = [self.AGENT_KILLER_TEMPLATES, self.AGENT_DEATH_TEMPLATES][agent_death]
+        # shape (agents, y, x) - the best agent and location are both read out of this single array
+        agent_matches = np.stack([
+            cv2.matchTemplate(agent_im, t[0], cv2.TM_SQDIFF, mask=t[1])
+            for t in templates.values()
+        ])
+        agent_match_m = np.min(agent_matches, axis=0)
         mnv, mxv, mnl, mxl = cv2.minMaxLoc(agent_match_m)
 
-        print(list(zip(self.AGENT_DEATH_TEMPLATES.keys(), agent_match_m)))
-
-        agent, agent_match = None, float('inf')
-        for a, m in agent_matches.items():
-            v = m[mnl[1], mnl[0]]
-            if v < agent_match:
-                agent_match = v
-                agent = a
+        agent_index = int(np.argmin(agent_matches[:, mnl[1], mnl[0]]))
+        agent = list(templates)[agent_index]
+        agent_match = agent_matches[agent_index, mnl[1], mnl[0]]
 
         return agent, float(agent_match), int(region_x + mnl[0])
 
@@ -394,7 +429,7 @@ class KillfeedProcessor(Processor):
             return None
         killed_name_norm = 255 - imageops.normalise(killed_name_gray, min=170)
         return textops.strip_string(
-            imageops.tesser_ocr(killed_name_norm, engine=imageops.tesseract_lstm).upper(),
+            ocr_name(killed_name_norm),
             alphabet=string.ascii_uppercase + string.digits + '# ',
         )
 
@@ -427,8 +462,12 @@ class KillfeedProcessor(Processor):
         weapon_thresh = ((weapon_gray - weapon_adapt_thresh > 30) * 255).astype(np.uint8)
 
         kill_modifiers_thresh = weapon_thresh[:, -75:]
-        _, wallbang_match, _, wallbang_loc = cv2.minMaxLoc(cv2.matchTemplate(kill_modifiers_thresh, self.WALLBANG_TEMPLATE, cv2.TM_CCORR_NORMED))
-        _, headshot_match, _, headshot_loc = cv2.minMaxLoc(cv2.matchTemplate(kill_modifiers_thresh, self.HEADSHOT_TEMPLATE, cv2.TM_CCORR_NORMED))
+        if cv2.countNonZero(kill_modifiers_thresh):
+            _, wallbang_match, _, wallbang_loc = cv2.minMaxLoc(cv2.matchTemplate(kill_modifiers_thresh, self.WALLBANG_TEMPLATE, cv2.TM_CCORR_NORMED))
+            _, headshot_match, _, headshot_loc = cv2.minMaxLoc(cv2.matchTemplate(kill_modifiers_thresh, self.HEADSHOT_TEMPLATE, cv2.TM_CCORR_NORMED))
+        else:
+            # nothing above threshold - TM_CCORR_NORMED against an empty image is 0 everywhere
+            wallbang_match, wallbang_loc = headshot_match, headshot_loc = 0, (0, 0)
         wallbang_match, headshot_match = float(wallbang_match), float(headshot_match)
         logger.debug(f'wallbang_match={wallbang_match:.2f}, headshot_match={headshot_match:.2f}')
 
@@ -597,7 +636,7 @@ class KillfeedProcessor(Processor):
             return None
         killer_name_norm = 255 - imageops.normalise(killer_name_gray, min=170)
         killer_name = textops.strip_string(
-            imageops.tesser_ocr(killer_name_norm, engine=imageops.tesseract_lstm).upper(),
+            ocr_name(killer_name_norm),
             alphabet=string.ascii_uppercase + string.digits + '#',
         )
         return killer_name